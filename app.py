@@ -1,50 +1,85 @@
 from __future__ import annotations
 
+import re
 from datetime import date
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, g
+from jinja2 import FileSystemBytecodeCache
 
 # Reuse storage and logic from the CLI module
 from todo import (
     add_task,
+    close_connection,
     list_tasks,
     edit_task,
     delete_tasks,
     mark_done,
     stats as stats_fn,
-    load_data,
-    Task,
+    get_task,
+    transaction,
 )
 
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "dev-secret-key"  # replace in production
 
+# Keep compiled templates on disk so a fresh process skips recompiling them;
+# where the app directory is read-only, just compile without the cache
+JINJA_CACHE_DIR = Path(app.root_path) / ".jinja_cache"
+try:
+    JINJA_CACHE_DIR.mkdir(exist_ok=True)
+except OSError:
+    pass
+else:
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(str(JINJA_CACHE_DIR))
+
+
+_DUE_RE = re.compile(r"\A(\d{4})-(\d{2})-(\d{2})\Z", re.ASCII)
+
 
 def parse_due(value: Optional[str]) -> Optional[str]:
-    if not value:
+    # Expect YYYY-MM-DD
+    m = _DUE_RE.match(value or "")
+    if not m:
         return None
-    try:
-        # Expect YYYY-MM-DD
-        return date.fromisoformat(value).isoformat()
-    except Exception:
+    year, month, day = int(m[1]), int(m[2]), int(m[3])
+    if year < 1 or not 1 <= month <= 12 or not 1 <= day <= 31:
         return None
+    if day > 28:
+        # Only days 29-31 can fall outside their month
+        try:
+            date(year, month, day)
+        except ValueError:
+            return None
+    return value
+
+
+def today_iso() -> str:
+    # One date per request, so the overdue count and row highlighting agree
+    if "today_iso" not in g:
+        g.today_iso = date.today().isoformat()
+    return g.today_iso
 
 
-def get_task_by_id(task_id: int) -> Optional[Task]:
-    data = load_data()
-    for raw in data["tasks"]:
-        if int(raw["id"]) == int(task_id):
-            return Task.from_dict(raw)
-    return None
+def current_stats() -> Dict[str, int]:
+    # Computed at most once per request, however many templates ask for it
+    if "stats" not in g:
+        g.stats = stats_fn(today_iso())
+    return g.stats
+
+
+@app.teardown_appcontext
+def close_db(exc: Optional[BaseException]) -> None:
+    # Each request runs on its own thread; don't leave its connection to the GC
+    close_connection()
 
 
 @app.context_processor
 def inject_globals():
     # Expose stats to all templates (base.html expects it)
-    return {"stats": stats_fn()}
+    return {"stats": current_stats()}
 
 
 @app.route("/")
@@ -53,13 +88,13 @@ def index():
     if kind not in ("pending", "all", "done"):
         kind = "pending"
     tasks = list_tasks(kind)
-    s = stats_fn()
+    s = current_stats()
     return render_template(
         "index.html",
         kind=kind,
         tasks=tasks,
         stats=s,
-        today=date.today().isoformat(),
+        today=today_iso(),
     )
 
 
@@ -82,17 +117,19 @@ def add():
 @app.post("/toggle/<int:task_id>")
 def toggle(task_id: int):
     act = request.args.get("act", "toggle")
-    if act == "done":
-        mark_done([task_id])
-    elif act == "undone":
-        edit_task(task_id, None, None, False, True)
-    else:
-        # If unknown, try to infer
-        task = get_task_by_id(task_id)
-        if task and task.completed:
+    # Look up and update in a single transaction
+    with transaction():
+        if act == "done":
+            mark_done([task_id])
+        elif act == "undone":
             edit_task(task_id, None, None, False, True)
         else:
-            mark_done([task_id])
+            # If unknown, try to infer
+            task = get_task(task_id)
+            if task and task.completed:
+                edit_task(task_id, None, None, False, True)
+            else:
+                mark_done([task_id])
     return redirect(url_for("index", filter=request.args.get("filter", "pending")))
 
 
@@ -108,7 +145,7 @@ def delete(task_id: int):
 
 @app.route("/edit/<int:task_id>", methods=["GET", "POST"])
 def edit(task_id: int):
-    task = get_task_by_id(task_id)
+    task = get_task(task_id)
     if not task:
         flash(f"見つかりませんでした: #{task_id}", "warning")
         return redirect(url_for("index"))
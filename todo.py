@@ -23,24 +23,55 @@ Usage examples:
       python todo.py clear --all
       python todo.py stats
 
-Data is stored in a `todos.json` file next to this script.
+Data is stored in a `todos.db` SQLite database next to this script. An
+existing `todos.json` from older versions is imported once, when the
+database is first created, and then renamed to `todos.json.imported`.
 """
 
 from __future__ import annotations
 
 import argparse
 import json
-from dataclasses import dataclass, asdict
-from datetime import datetime, date
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, date, timezone
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator, Set
+
+
+DB_FILE = Path(__file__).with_name("todos.db")
+DATA_FILE = Path(__file__).with_name("todos.json")  # legacy storage, imported once
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    due TEXT,
+    completed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_due ON tasks(completed, due);
+-- Matches list_tasks("pending") ORDER BY, so the default listing needs no sort step
+CREATE INDEX IF NOT EXISTS idx_pending_order
+    ON tasks(completed, due IS NULL, due, created_at);
+-- Same for list_tasks("done"): newest completed_at first, ties by id
+CREATE INDEX IF NOT EXISTS idx_done_order ON tasks(completed, completed_at DESC);
+"""
 
+# Database files this process has already set up, see _prepare()
+_READY: Set[Path] = set()
+_READY_LOCK = threading.Lock()
 
-DATA_FILE = Path(__file__).with_name("todos.json")
+# The current thread's connection; the web app closes it after each request
+_LOCAL = threading.local()
 
 
 def now_iso() -> str:
-    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
 def parse_date(s: Optional[str]) -> Optional[str]:
@@ -56,12 +87,12 @@ def parse_date(s: Optional[str]) -> Optional[str]:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Task:
     id: int
     title: str
     completed: bool = False
-    created_at: str = now_iso()
+    created_at: str = field(default_factory=now_iso)
     due: Optional[str] = None  # YYYY-MM-DD
     completed_at: Optional[str] = None
 
@@ -76,132 +107,253 @@ class Task:
             completed_at=d.get("completed_at"),
         )
 
+    @staticmethod
+    def from_row(row: sqlite3.Row) -> "Task":
+        return Task(
+            id=row["id"],
+            title=row["title"],
+            completed=bool(row["completed"]),
+            created_at=row["created_at"],
+            due=row["due"],
+            completed_at=row["completed_at"],
+        )
+
 
-def load_data() -> Dict[str, Any]:
-    if not DATA_FILE.exists():
-        return {"next_id": 1, "tasks": []}
+def get_connection() -> sqlite3.Connection:
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is None or _LOCAL.path != DB_FILE:
+        close_connection()
+        _prepare(DB_FILE)
+        # Autocommit; multi-statement changes go through transaction()
+        conn = sqlite3.connect(DB_FILE, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # Per-connection setting; journal_mode=WAL is stored in the file itself
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _LOCAL.conn = conn
+        _LOCAL.path = DB_FILE
+    return conn
+
+
+def close_connection() -> None:
+    """Close the current thread's connection, if it has one open."""
+    conn = getattr(_LOCAL, "conn", None)
+    if conn is not None:
+        _LOCAL.conn = None
+        conn.close()
+
+
+def _prepare(path: Path) -> None:
+    # Schema, WAL mode and the todos.json import: once per database per process
+    with _READY_LOCK:
+        if path in _READY:
+            return
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            imported = False
+            if _user_version(conn) < 1:
+                # Decide under the write lock, so concurrent first connects import
+                # once; a failed import rolls back and is retried next time
+                with transaction(conn):
+                    if _user_version(conn) < 1:
+                        if DATA_FILE.exists():
+                            _import_json(conn, DATA_FILE)
+                            imported = True
+                        conn.execute("PRAGMA user_version = 1")
+            if imported:
+                # Now committed: move the file aside so a lost or deleted
+                # todos.db can't bring back tasks cleared since the import
+                DATA_FILE.replace(DATA_FILE.with_name(DATA_FILE.name + ".imported"))
+        finally:
+            conn.close()
+        _READY.add(path)
+
+
+def _user_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _import_json(conn: sqlite3.Connection, path: Path) -> None:
     try:
-        with DATA_FILE.open("r", encoding="utf-8") as f:
-            data = json.load(f)
+        data = json.loads(path.read_bytes())
         if not isinstance(data, dict):
             raise ValueError("Corrupt data file root")
-        data.setdefault("next_id", 1)
-        data.setdefault("tasks", [])
-        # sanitize tasks
-        data["tasks"] = [asdict(Task.from_dict(t)) for t in data["tasks"]]
-        return data
-    except json.JSONDecodeError:
-        raise SystemExit(f"Failed to parse {DATA_FILE.name}. Fix or delete it.")
+        tasks = [Task.from_dict(t) for t in data.get("tasks", [])]
+        next_id = int(data.get("next_id", 1))
+    except (ValueError, KeyError, TypeError):
+        # JSONDecodeError is a ValueError; the rest come from malformed rows
+        raise SystemExit(f"Failed to parse {path.name}. Fix or delete it.")
+    dupes = sorted(i for i, n in Counter(t.id for t in tasks).items() if n > 1)
+    if dupes:
+        raise SystemExit(
+            f"Duplicate task ids in {path.name}: "
+            f"{', '.join(map(str, dupes))}. Give them unique ids and run again."
+        )
+    conn.executemany(
+        "INSERT INTO tasks (id, title, completed, created_at, due, completed_at)"
+        " VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            # The JSON backend treated "" as unset; store it as NULL
+            (
+                t.id,
+                t.title,
+                t.completed,
+                t.created_at,
+                t.due or None,
+                t.completed_at or None,
+            )
+            for t in tasks
+        ],
+    )
+    # Carry next_id over so ids of deleted tasks are not handed out again
+    last_id = max([next_id - 1] + [t.id for t in tasks])
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'tasks'")
+    conn.execute(
+        "INSERT INTO sqlite_sequence (name, seq) VALUES ('tasks', ?)", (last_id,)
+    )
+
+
+@contextmanager
+def transaction(
+    conn: Optional[sqlite3.Connection] = None,
+) -> Iterator[sqlite3.Connection]:
+    """Run the block in one transaction, committing on success.
+
+    Nested uses join the outer transaction, so several helpers called inside
+    one ``with transaction():`` are committed together.
+    """
+    if conn is None:
+        conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
 
 
-def save_data(data: Dict[str, Any]) -> None:
-    with DATA_FILE.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def _id_match(ids: List[int]) -> str:
+    # The web UI always sends a single id: use a plain key lookup for it
+    if len(ids) == 1:
+        return "id = ?"
+    return f"id IN ({', '.join('?' * len(ids))})"
 
 
 def add_task(title: str, due: Optional[str]) -> Task:
-    data = load_data()
-    tid = int(data["next_id"])
-    task = Task(id=tid, title=title, due=due)
-    data["tasks"].append(asdict(task))
-    data["next_id"] = tid + 1
-    save_data(data)
-    return task
-
-
-def list_tasks(kind: str) -> List[Task]:
-    data = load_data()
-    tasks = [Task.from_dict(t) for t in data["tasks"]]
-    if kind == "pending":
-        tasks = [t for t in tasks if not t.completed]
-    elif kind == "done":
-        tasks = [t for t in tasks if t.completed]
-    # else 'all' -> no filter
+    created_at = now_iso()
+    cur = get_connection().execute(
+        "INSERT INTO tasks (title, created_at, due) VALUES (?, ?, ?)",
+        (title, created_at, due),
+    )
+    return Task(id=cur.lastrowid, title=title, created_at=created_at, due=due)
+
+
+def get_task(id_: int) -> Optional[Task]:
+    conn = get_connection()
+    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (id_,)).fetchone()
+    return Task.from_row(row) if row is not None else None
+
+
+def list_tasks(kind: str) -> List[sqlite3.Row]:
+    """Return task rows for display; fields are readable as row["title"]."""
     # Sort pending by due date (None last), then created_at; done by completed_at desc
-    if kind in ("pending", "all"):
-        tasks.sort(
-            key=lambda t: (
-                (t.due is None, t.due or "9999-12-31"),
-                t.created_at,
-            )
-        )
+    if kind == "pending":
+        sql = "SELECT * FROM tasks WHERE completed = 0 ORDER BY due IS NULL, due, created_at, id"
     elif kind == "done":
-        tasks.sort(key=lambda t: t.completed_at or "", reverse=True)
-    return tasks
+        sql = "SELECT * FROM tasks WHERE completed = 1 ORDER BY completed_at DESC, id"
+    else:
+        # 'all' -> no filter
+        sql = "SELECT * FROM tasks ORDER BY due IS NULL, due, created_at, id"
+    return get_connection().execute(sql).fetchall()
 
 
 def mark_done(ids: List[int]) -> List[Task]:
-    data = load_data()
-    idset = set(ids)
-    updated: List[Task] = []
-    for i, raw in enumerate(data["tasks"]):
-        if raw["id"] in idset and not raw.get("completed", False):
-            raw["completed"] = True
-            raw["completed_at"] = now_iso()
-            updated.append(Task.from_dict(raw))
-    save_data(data)
+    # SELECT then UPDATE rather than UPDATE ... RETURNING, which needs SQLite 3.35+
+    where = f"WHERE {_id_match(ids)} AND completed = 0"
+    with transaction() as conn:
+        updated = [
+            Task.from_row(r)
+            for r in conn.execute(f"SELECT * FROM tasks {where} ORDER BY id", ids)
+        ]
+        if updated:
+            completed_at = now_iso()
+            conn.execute(
+                f"UPDATE tasks SET completed = 1, completed_at = ? {where}",
+                (completed_at, *ids),
+            )
+            for t in updated:
+                t.completed = True
+                t.completed_at = completed_at
     return updated
 
 
 def delete_tasks(ids: List[int]) -> int:
-    data = load_data()
-    idset = set(ids)
-    before = len(data["tasks"])
-    data["tasks"] = [t for t in data["tasks"] if t["id"] not in idset]
-    after = len(data["tasks"])
-    save_data(data)
-    return before - after
+    cur = get_connection().execute(f"DELETE FROM tasks WHERE {_id_match(ids)}", ids)
+    return cur.rowcount
 
 
 def edit_task(
     id_: int, title: Optional[str], due: Optional[str], clear_due: bool, undone: bool
 ) -> Optional[Task]:
-    data = load_data()
-    for raw in data["tasks"]:
-        if int(raw["id"]) == id_:
-            if title is not None:
-                raw["title"] = title
-            if clear_due:
-                raw["due"] = None
-            elif due is not None:
-                raw["due"] = due
-            if undone and raw.get("completed"):
-                raw["completed"] = False
-                raw["completed_at"] = None
-            save_data(data)
-            return Task.from_dict(raw)
-    return None
+    with transaction() as conn:
+        task = get_task(id_)
+        if task is None:
+            return None
+        # Only write the columns that actually change
+        changes: Dict[str, Any] = {}
+        if title is not None and title != task.title:
+            changes["title"] = title
+        if clear_due and task.due is not None:
+            changes["due"] = None
+        elif not clear_due and due is not None and due != task.due:
+            changes["due"] = due
+        if undone and task.completed:
+            changes["completed"] = False
+            changes["completed_at"] = None
+        if changes:
+            assignments = ", ".join(f"{col} = ?" for col in changes)
+            conn.execute(
+                f"UPDATE tasks SET {assignments} WHERE id = ?",
+                (*changes.values(), id_),
+            )
+            for col, value in changes.items():
+                setattr(task, col, value)
+        return task
 
 
 def clear_tasks(mode: str) -> int:
-    data = load_data()
-    before = len(data["tasks"])
-    if mode == "done":
-        data["tasks"] = [t for t in data["tasks"] if not t.get("completed", False)]
-    elif mode == "all":
-        data["tasks"] = []
-        data["next_id"] = 1
-    else:
-        raise ValueError("Unknown clear mode")
-    after = len(data["tasks"])
-    save_data(data)
-    return before - after
-
-
-def stats() -> Dict[str, int]:
-    data = load_data()
-    total = len(data["tasks"])
-    done = sum(1 for t in data["tasks"] if t.get("completed", False))
-    pending = total - done
-    overdue = 0
-    today = date.today().isoformat()
-    for t in data["tasks"]:
-        if not t.get("completed", False) and t.get("due") and t["due"] < today:
-            overdue += 1
-    return {"total": total, "pending": pending, "done": done, "overdue": overdue}
-
-
-def format_tasks(tasks: List[Task]) -> str:
+    with transaction() as conn:
+        if mode == "done":
+            cur = conn.execute("DELETE FROM tasks WHERE completed = 1")
+        elif mode == "all":
+            cur = conn.execute("DELETE FROM tasks")
+            # Reset IDs
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'tasks'")
+        else:
+            raise ValueError("Unknown clear mode")
+        return cur.rowcount
+
+
+def stats(today: Optional[str] = None) -> Dict[str, int]:
+    """Count tasks; ``today`` (YYYY-MM-DD) defaults to the current date."""
+    if today is None:
+        today = date.today().isoformat()
+    # One pass over the (completed, due) index; no table rows are read
+    conn = get_connection()
+    total, done, overdue = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(completed), 0),"
+        " COALESCE(SUM(completed = 0 AND due < ?), 0) FROM tasks",
+        (today,),
+    ).fetchone()
+    return {"total": total, "pending": total - done, "done": done, "overdue": overdue}
+
+
+def format_tasks(tasks: List[sqlite3.Row]) -> str:
     if not tasks:
         return "(no tasks)"
 
@@ -209,27 +361,23 @@ def format_tasks(tasks: List[Task]) -> str:
     headers = ["ID", "Title", "Due", "Status", "Created"]
     rows = []
     for t in tasks:
-        status = "done" if t.completed else "pending"
+        status = "done" if t["completed"] else "pending"
         rows.append(
             [
-                str(t.id),
-                t.title,
-                t.due or "-",
+                str(t["id"]),
+                t["title"],
+                t["due"] or "-",
                 status,
-                t.created_at.replace("T", " ").rstrip("Z"),
+                t["created_at"].replace("T", " ").rstrip("Z"),
             ]
         )
 
-    widths = [len(h) for h in headers]
-    for r in rows:
-        for i, cell in enumerate(r):
-            widths[i] = max(widths[i], len(cell))
-
-    def fmt_row(vals):
-        return "  ".join(val.ljust(widths[i]) for i, val in enumerate(vals))
+    widths = [max(map(len, col)) for col in zip(headers, *rows)]
+    # One format string for every row; padding happens inside str.format
+    fmt = "  ".join("{:<%d}" % w for w in widths)
 
-    lines = [fmt_row(headers), fmt_row(["-" * w for w in widths])]
-    lines += [fmt_row(r) for r in rows]
+    lines = [fmt.format(*headers), fmt.format(*("-" * w for w in widths))]
+    lines += [fmt.format(*r) for r in rows]
     return "\n".join(lines)
 
 